@@ -5,14 +5,16 @@ import threading
 import queue
 from dotenv import load_dotenv
 import csv
+import io
 import re
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
 from mutagen.mp4 import MP4
 import spotipy
+from spotipy.cache_handler import CacheFileHandler
 from spotipy.oauth2 import SpotifyClientCredentials
-from songDownloader import download_song, sanitize_filename
+from songDownloader import download_song, sanitize_filename, song_filename
 
 # Load environment variables
 env_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -30,27 +32,32 @@ if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
 sp = spotipy.Spotify(
     auth_manager=SpotifyClientCredentials(
         client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        # Pin the token cache next to the script so a still-valid token is
+        # reused across runs no matter which directory they start from
+        cache_handler=CacheFileHandler(
+            cache_path=os.path.join(os.path.dirname(__file__), '.cache_spotify')
+        )
     )
 )
 
 csv_lock = Lock()
 
+# Compiled once; used to pull the ID out of playlist URLs and URIs
+PLAYLIST_ID_PATTERN = re.compile(r'playlist[/:]([a-zA-Z0-9]+)')
+
 
 def extract_playlist_id(playlist_input):
     """Extract playlist ID from URL, URI, or ID string"""
-    if len(playlist_input) == 22 and not ('/' in playlist_input or ':' in playlist_input):
-        return playlist_input
-    
-    if 'open.spotify.com/playlist/' in playlist_input:
-        match = re.search(r'playlist/([a-zA-Z0-9]+)', playlist_input)
-        if match:
-            return match.group(1)
-    
-    if 'spotify:playlist:' in playlist_input:
-        return playlist_input.split(':')[-1]
-    
-    return playlist_input
+    # Matches both "open.spotify.com/playlist/<id>" and "spotify:playlist:<id>";
+    # anything else (e.g. a bare ID) is returned unchanged
+    match = PLAYLIST_ID_PATTERN.search(playlist_input)
+    return match.group(1) if match else playlist_input
+
+
+def track_key(artist, title):
+    """Build the history key for a track, ignoring case and surrounding whitespace"""
+    return f"{artist.strip().casefold()}|{title.strip().casefold()}"
 
 
 def load_downloaded_tracks(csv_path):
@@ -60,10 +67,30 @@ def load_downloaded_tracks(csv_path):
     
     downloaded = set()
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                track_id = f"{row['artist']}|{row['title']}"
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            data = f.read()
+
+        if not data.strip():
+            # An empty file just means nothing has been recorded yet
+            return downloaded
+
+        if '"' not in data:
+            # Unquoted file: no field contains a comma or line break, so
+            # plain string splitting parses it exactly and much faster
+            lines = data.replace('\r', '').split('\n')
+            header = lines[0].split(',')
+            artist_col = header.index('artist')
+            title_col = header.index('title')
+            min_len = max(artist_col, title_col) + 1
+            rows = (line.split(',') for line in lines[1:] if line)
+            # Skip short rows (e.g. hand-edited or blank lines) rather than
+            # letting one bad row discard the whole history
+            downloaded = {track_key(row[artist_col], row[title_col]) for row in rows if len(row) >= min_len}
+        else:
+            for row in csv.DictReader(io.StringIO(data)):
+                # Create unique identifier from artist and title; DictReader
+                # fills missing fields with None
+                track_id = track_key(row['artist'] or '', row['title'] or '')
                 downloaded.add(track_id)
     except Exception as e:
         print(f"Error reading history CSV: {e}")
@@ -71,33 +98,90 @@ def load_downloaded_tracks(csv_path):
     return downloaded
 
 
-def save_downloaded_track(csv_path, song):
-    """Append a successfully downloaded track to the CSV"""
-    file_exists = os.path.exists(csv_path)
-    
+def open_history(csv_path):
+    """Open the history CSV for appending, writing the header if it is new"""
+    history_file = open(csv_path, 'a', newline='', encoding='utf-8')
+    if history_file.tell() == 0:
+        csv.DictWriter(history_file, fieldnames=['artist', 'title', 'album']).writeheader()
+    return history_file
+
+
+def save_downloaded_track(history_file, song):
+    """Append a successfully downloaded track to the open history CSV"""
     with csv_lock:
         try:
-            with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['artist', 'title', 'album'])
-                if not file_exists:
-                    writer.writeheader()
-                writer.writerow({
-                    'artist': song['artist'],
-                    'title': song['title'],
-                    'album': song['album']
-                })
+            writer = csv.DictWriter(history_file, fieldnames=['artist', 'title', 'album'])
+            writer.writerow({
+                'artist': song['artist'],
+                'title': song['title'],
+                'album': song['album']
+            })
+            # Flush each row so finished tracks survive an interrupted run
+            history_file.flush()
         except Exception as e:
             print(f"Error saving to history CSV: {e}")
 
 
+def history_stamp(csv_path):
+    """Return the history CSV's size and mtime, or None if it doesn't exist"""
+    try:
+        stat = os.stat(csv_path)
+    except OSError:
+        return None
+    return f"{stat.st_size} {stat.st_mtime_ns}"
+
+
+def load_snapshot(snapshot_path):
+    """Load the snapshot_id and history stamp saved after the last complete sync"""
+    if not os.path.exists(snapshot_path):
+        return None, None
+
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        snapshot_id = lines[0].strip() or None
+        stamp = lines[1].strip() if len(lines) > 1 else None
+        return snapshot_id, stamp or None
+    except Exception as e:
+        print(f"Error reading snapshot file: {e}")
+        return None, None
+
+
+def save_snapshot(snapshot_path, snapshot_id, csv_path):
+    """Save the playlist snapshot_id together with the history CSV's current stamp"""
+    try:
+        with open(snapshot_path, 'w', encoding='utf-8') as f:
+            f.write(f"{snapshot_id}\n{history_stamp(csv_path) or ''}\n")
+    except Exception as e:
+        print(f"Error saving snapshot file: {e}")
+
+
+def fetch_playlist_page(playlist_url, offset):
+    """Fetch one page (up to 100 items) of a Spotify playlist"""
+    # Request only the fields get_playlist_tracks reads; the full payload is ~10x larger
+    return sp.playlist_tracks(
+        playlist_url,
+        fields='total,items(track(name,artists(id,name),album(name,images(url))))',
+        limit=100,
+        offset=offset
+    )
+
+
+def get_snapshot_id(playlist_url):
+    """Fetch only the playlist's snapshot_id, which changes on every edit"""
+    return sp.playlist(playlist_url, fields='snapshot_id')['snapshot_id']
+
+
 def get_playlist_tracks(playlist_url):
     """Fetch all track info from a Spotify playlist"""
-    results = sp.playlist_tracks(playlist_url)
+    results = fetch_playlist_page(playlist_url, 0)
     tracks = results['items']
 
-    while results['next']:
-        results = sp.next(results)
-        tracks.extend(results['items'])
+    # The first page reports the total, so request the remaining pages concurrently
+    offsets = range(100, results['total'], 100)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for page in executor.map(fetch_playlist_page, [playlist_url] * len(offsets), offsets):
+            tracks.extend(page['items'])
 
     songs = []
     for item in tracks:
@@ -109,26 +193,46 @@ def get_playlist_tracks(playlist_url):
         track_name = track['name']
         album = track['album']['name']
         cover_url = track['album']['images'][0]['url'] if track['album']['images'] else None
-        track_id = track['artists'][0]['id']
-
-        genre = None
-        try:
-            artist_info = sp.artist(track_id)
-            if artist_info['genres']:
-                genre = artist_info['genres'][0].title()
-        except Exception:
-            genre = None
+        artist_id = track['artists'][0]['id']
 
         songs.append({
             "artist": artist,
             "title": track_name,
             "album": album,
             "cover_url": cover_url,
-            "genre": genre
+            "artist_id": artist_id,
+            "genre": None
         })
     return songs
 
 
+def fetch_artist_genres(artist_ids):
+    """Fetch the primary genre for a batch of up to 50 artist IDs"""
+    genres = {}
+    try:
+        for artist in sp.artists(artist_ids)['artists']:
+            if artist and artist['genres']:
+                genres[artist['id']] = artist['genres'][0].title()
+    except Exception:
+        pass
+    return genres
+
+
+def fill_genres(songs):
+    """Fill in each song's genre from its artist's metadata"""
+    # Look up each artist once, 50 per request, with a few requests in flight
+    artist_ids = list({song['artist_id'] for song in songs if song['artist_id']})
+    batches = [artist_ids[i:i + 50] for i in range(0, len(artist_ids), 50)]
+
+    genres = {}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for batch_genres in executor.map(fetch_artist_genres, batches):
+            genres.update(batch_genres)
+
+    for song in songs:
+        song['genre'] = genres.get(song['artist_id'])
+
+
 def download_from_youtube(song, download_dir):
     """Download song from YouTube using songDownloader utility"""
     # Validate song title
@@ -139,13 +243,12 @@ def download_from_youtube(song, download_dir):
     success = download_song(song['title'], song['artist'], download_dir)
     
     if success:
-        # Create filename with artist - title format
-        safe_artist = sanitize_filename(song['artist'])
+        # Same "Artist - Title" name download_song wrote the file under
         safe_title = sanitize_filename(song['title'])
         if not safe_title or not safe_title.strip():
             print(f"⚠️ Sanitized title is empty for: {song['title']}")
             return None
-        return os.path.join(download_dir, f"{safe_artist} - {safe_title}.m4a")
+        return os.path.join(download_dir, song_filename(song['title'], song['artist']))
     return None
 
 
@@ -175,14 +278,21 @@ def apply_metadata(m4a_path, song):
         print(f"Metadata error for {song['title']}: {e}")
 
 
-def process_song(song, download_dir, csv_path, log_queue):
+def process_existing_song(song, download_dir, history_file):
+    """Tag a song whose file is already on disk and record it in history"""
+    m4a_path = os.path.join(download_dir, song_filename(song['title'], song['artist']))
+    apply_metadata(m4a_path, song)
+    save_downloaded_track(history_file, song)
+
+
+def process_song(song, download_dir, history_file, log_queue):
     """Download and apply metadata to a single song"""
     try:
         log_queue.put(f"🎧 Downloading: {song['artist']} - {song['title']}")
         m4a_path = download_from_youtube(song, download_dir)
         if m4a_path:
             apply_metadata(m4a_path, song)
-            save_downloaded_track(csv_path, song)
+            save_downloaded_track(history_file, song)
             log_queue.put(f"✅ Completed: {song['title']}\n")
             return True, song['title']
         else:
@@ -235,9 +345,16 @@ class PlaylistDownloaderUI:
         
         # Thread Count
         ttk.Label(main_frame, text="Concurrent Downloads:").grid(row=2, column=0, sticky=tk.W, pady=5)
-        self.threads_spinbox = ttk.Spinbox(main_frame, from_=1, to=20, width=10)
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=2, column=1, sticky=tk.W, pady=5, padx=5)
+        
+        self.threads_spinbox = ttk.Spinbox(options_frame, from_=1, to=20, width=10)
         self.threads_spinbox.set(4)
-        self.threads_spinbox.grid(row=2, column=1, sticky=tk.W, pady=5, padx=5)
+        self.threads_spinbox.grid(row=0, column=0)
+        
+        # Force a full re-check even when the playlist snapshot is unchanged
+        self.force_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Force full sync", variable=self.force_var).grid(row=0, column=1, padx=(15, 0))
         
         # Progress Bar
         ttk.Label(main_frame, text="Progress:").grid(row=3, column=0, sticky=tk.W, pady=5)
@@ -318,7 +435,7 @@ class PlaylistDownloaderUI:
         # Start download in separate thread
         self.download_thread = threading.Thread(
             target=self.download_playlist,
-            args=(playlist_url, output_dir, threads),
+            args=(playlist_url, output_dir, threads, self.force_var.get()),
             daemon=True
         )
         self.download_thread.start()
@@ -328,7 +445,7 @@ class PlaylistDownloaderUI:
         self.log_message("\n⚠️ Stop requested (current downloads will complete)...\n")
         # Note: Graceful stopping would require more complex thread management
     
-    def download_playlist(self, playlist_url, output_dir, num_threads):
+    def download_playlist(self, playlist_url, output_dir, num_threads, force=False):
         try:
             # Create output directory
             os.makedirs(output_dir, exist_ok=True)
@@ -338,6 +455,17 @@ class PlaylistDownloaderUI:
             playlists_dir = os.path.join(os.path.dirname(__file__), 'playlists')
             os.makedirs(playlists_dir, exist_ok=True)
             csv_path = os.path.join(playlists_dir, f"{playlist_id}.csv")
+            snapshot_path = os.path.join(playlists_dir, f"{playlist_id}.snapshot")
+            
+            # Skip fetching every page when neither the playlist nor its history CSV
+            # has changed since the last complete sync (deleting or editing the CSV
+            # always triggers a full re-check)
+            snapshot_id = get_snapshot_id(playlist_url)
+            stamp = history_stamp(csv_path)
+            if not force and stamp is not None and (snapshot_id, stamp) == load_snapshot(snapshot_path):
+                self.log_queue.put("✅ Playlist unchanged since last sync, nothing to download! (tick \"Force full sync\" to re-check)\n")
+                self.download_complete(0, 0, 0)
+                return
             
             # Load previously downloaded tracks
             downloaded_tracks = load_downloaded_tracks(csv_path)
@@ -348,15 +476,36 @@ class PlaylistDownloaderUI:
             songs = get_playlist_tracks(playlist_url)
             self.log_queue.put(f"Found {len(songs)} tracks in playlist.\n")
             
-            # Filter new songs
-            new_songs = []
-            for song in songs:
-                track_id = f"{song['artist']}|{song['title']}"
-                if track_id not in downloaded_tracks:
-                    new_songs.append(song)
+            # Filter out already downloaded tracks; keying by track also drops
+            # duplicate playlist entries so they aren't downloaded twice at once
+            songs_by_id = {track_key(song['artist'], song['title']): song for song in songs}
+            new_ids = songs_by_id.keys() - downloaded_tracks
+            new_songs = [song for track_id, song in songs_by_id.items() if track_id in new_ids]
+            
+            fill_genres(new_songs)
+            
+            # Tracks already on disk (e.g. history was deleted) only need tagging and recording
+            # A single directory scan; entry types come from readdir, not per-file stat calls
+            with os.scandir(output_dir) as entries:
+                existing_files = {entry.name for entry in entries if entry.is_file()}
+            on_disk = []
+            to_download = []
+            for song in new_songs:
+                if song_filename(song['title'], song['artist']) in existing_files:
+                    on_disk.append(song)
+                else:
+                    to_download.append(song)
+            new_songs = to_download
+            if on_disk:
+                # Only the download is skipped; the files are still tagged in case an
+                # earlier run stopped between downloading and tagging them
+                with open_history(csv_path) as history_file, ThreadPoolExecutor(max_workers=num_threads) as executor:
+                    list(executor.map(process_existing_song, on_disk, [output_dir] * len(on_disk), [history_file] * len(on_disk)))
+                self.log_queue.put(f"📁 Already on disk, tagged and added to history: {len(on_disk)} tracks\n")
             
             if not new_songs:
                 self.log_queue.put("✅ No new tracks to download!\n")
+                save_snapshot(snapshot_path, snapshot_id, csv_path)
                 self.download_complete(0, 0, 0)
                 return
             
@@ -371,10 +520,10 @@ class PlaylistDownloaderUI:
             successful = 0
             failed = 0
             
-            # Download with thread pool
-            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            # Download with thread pool, keeping the history file open for the run
+            with open_history(csv_path) as history_file, ThreadPoolExecutor(max_workers=num_threads) as executor:
                 futures = {
-                    executor.submit(process_song, song, output_dir, csv_path, self.log_queue): song 
+                    executor.submit(process_song, song, output_dir, history_file, self.log_queue): song 
                     for song in new_songs
                 }
                 
@@ -389,6 +538,10 @@ class PlaylistDownloaderUI:
                     self.progress['value'] = successful + failed
                     self.root.update_idletasks()
             
+            # Only remember the snapshot once nothing is left to retry
+            if failed == 0:
+                save_snapshot(snapshot_path, snapshot_id, csv_path)
+            
             self.download_complete(successful, failed, len(new_songs))
             
         except Exception as e:
@@ -3,27 +3,73 @@
 Small helper used by higher-level scripts to download a single song
 by searching YouTube via yt-dlp. Exposes `download_song` returning
 True/False to indicate success without raising.
+
+yt-dlp is driven in-process through its Python API rather than spawned
+as a subprocess, so each download skips interpreter startup and module
+imports. Setting USE_ARIA2C=1 hands the transfer itself to aria2c.
 """
 
-import subprocess
 import os
-from typing import List
+import shutil
+from typing import Any, Dict
+
+from yt_dlp import YoutubeDL
+
+
+class _SilentLogger:
+    """yt-dlp logger that discards everything, including ERROR lines.
+
+    quiet/no_warnings don't stop YoutubeDL.report_error from writing to
+    stderr; failures are reported to callers through the return value.
+    """
+
+    def debug(self, msg: str) -> None:
+        pass
 
+    def warning(self, msg: str) -> None:
+        pass
 
-def _build_command(search_query: str, output_template: str) -> List[str]:
-    """Construct the yt-dlp command for a given search query and output path."""
-    return [
-        "yt-dlp",
-        "-x",  # extract audio
-        "--audio-format",
-        "m4a",  # M4A format
-        "--audio-quality",
-        "0",  # best available quality
-        "--quiet",  # keep stdout clean for callers
-        "-o",
-        output_template,
-        f"ytsearch1:{search_query}",
-    ]
+    def error(self, msg: str) -> None:
+        pass
+
+
+# Options shared by every download; built once at import time
+_BASE_OPTIONS: Dict[str, Any] = {
+    "format": "bestaudio/best",
+    "postprocessors": [
+        {
+            "key": "FFmpegExtractAudio",  # extract audio
+            "preferredcodec": "m4a",  # M4A format
+            "preferredquality": "0",  # best available quality
+        }
+    ],
+    # What the CLI's -x --audio-format m4a also sets; lets yt-dlp recognise an
+    # already-converted .m4a instead of only looking for the source extension
+    "final_ext": "m4a",
+    "quiet": True,  # keep stdout clean for callers
+    "logger": _SilentLogger(),  # errors too, as the old captured subprocess did
+    "no_warnings": True,  # warnings from concurrent workers would interleave
+    "noprogress": True,  # don't render progress lines nobody reads
+    "overwrites": False,  # skip the download if the final .m4a exists (relies on final_ext)
+    "concurrent_fragment_downloads": 8,  # parallelize fragmented (HLS/DASH) streams
+}
+
+# aria2c (opt-in via USE_ARIA2C=1, and only if installed): yt-dlp passes it
+# its multi-connection flags; --quiet keeps its console output as silent as
+# the native downloader, since yt-dlp doesn't capture aria2c's stdout
+_ARIA2C_OPTIONS: Dict[str, Any] = {
+    "external_downloader": {"default": "aria2c"},
+    "external_downloader_args": {"aria2c": ["--quiet=true"]},
+}
+
+
+def _build_options(output_template: str) -> Dict[str, Any]:
+    """Construct the YoutubeDL options for a given output path."""
+    options = {**_BASE_OPTIONS, "outtmpl": output_template}
+    # Read at call time so a USE_ARIA2C set in the callers' .env is honoured
+    if os.environ.get("USE_ARIA2C") == "1" and shutil.which("aria2c"):
+        options.update(_ARIA2C_OPTIONS)
+    return options
 
 
 def sanitize_filename(filename: str) -> str:
@@ -42,6 +88,11 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
+def song_filename(track_name: str, artist: str, ext: str = "m4a") -> str:
+    """Return the "Artist - Title.<ext>" filename used for a downloaded song."""
+    return f"{sanitize_filename(artist)} - {sanitize_filename(track_name)}.{ext}"
+
+
 def download_song(track_name: str, artist: str, download_folder: str) -> bool:
     """Download a song using yt-dlp search of YouTube.
 
@@ -51,20 +102,19 @@ def download_song(track_name: str, artist: str, download_folder: str) -> bool:
         download_folder: Destination directory for the output audio file.
 
     Returns:
-        True if the yt-dlp command exits successfully; False otherwise.
+        True if yt-dlp reports a successful download; False otherwise.
     """
-    if not os.path.exists(download_folder):
-        os.makedirs(download_folder, exist_ok=True)
+    os.makedirs(download_folder, exist_ok=True)
     
     search_query = f"{artist} - {track_name}"
     # Sanitize artist and track name for filesystem - use "Artist - Title" format
-    safe_artist = sanitize_filename(artist)
-    safe_track_name = sanitize_filename(track_name)
-    output_template = os.path.join(download_folder, f"{safe_artist} - {safe_track_name}.%(ext)s")
-    command = _build_command(search_query, output_template)
+    output_template = os.path.join(download_folder, song_filename(track_name, artist, "%(ext)s"))
+    options = _build_options(output_template)
 
     try:
-        subprocess.run(command, check=True, capture_output=True, text=True)
-        return True
+        # One YoutubeDL per call: instances hold per-download state and
+        # download_song is invoked concurrently from worker threads.
+        with YoutubeDL(options) as ydl:
+            return ydl.download([f"ytsearch1:{search_query}"]) == 0
     except Exception:
         return False